@@ -0,0 +1,12 @@
+import pickle
+import numpy as np
+
+print("[INFO] Loading encodings.pickle...")
+with open("encodings.pickle", "rb") as f:
+    data = pickle.load(f)
+
+print("[INFO] Converting encodings to float32 .npy...")
+np.save("known.npy", np.stack(data["encodings"]).astype(np.float32))
+np.save("names.npy", np.asarray(data["names"]))
+
+print(f"[INFO] Conversion complete. {len(data['names'])} encodings saved to 'known.npy' and 'names.npy'")
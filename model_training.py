@@ -3,6 +3,7 @@ from imutils import paths
 import face_recognition
 import pickle
 import cv2
+import numpy as np
 
 print("[INFO] start processing faces...")
 imagePaths = list(paths.list_images("dataset"))
@@ -26,6 +27,8 @@ for (i, imagePath) in enumerate(imagePaths):
 print("[INFO] serializing encodings...")
 data = {"encodings": knownEncodings, "names": knownNames}
 with open("encodings.pickle", "wb") as f:
-    f.write(pickle.dumps(data))
+    pickle.dump(data, f)
+np.save("known.npy", np.stack(knownEncodings).astype(np.float32))
+np.save("names.npy", np.asarray(knownNames))
 
-print("[INFO] Training complete. Encodings saved to 'encodings.pickle'")
\ No newline at end of file
+print("[INFO] Training complete. Encodings saved to 'encodings.pickle', 'known.npy' and 'names.npy'")
\ No newline at end of file
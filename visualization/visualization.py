@@ -5,18 +5,22 @@ from dash import Dash, dcc, html
 
 # --- Read and preprocess CSV ---
 csv_file = "detections_log.csv"
-df = pd.read_csv(csv_file)
+df = pd.read_csv(csv_file, engine='pyarrow')
 
 # Convert timestamp to datetime and clean up
+# (coerce, since every recognizer start appends another header row to the log)
 df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
 df = df.dropna(subset=['name', 'timestamp'])
-df['confidence'] = df['confidence'].astype(float)
-df['detected_duration'] = df['detected_duration'].astype(float)
+df['confidence'] = df['confidence'].astype('float32')
+df['detected_duration'] = df['detected_duration'].astype('float32')
+# Names as categories so groupbys hash integer codes
+df['name'] = df['name'].astype('category')
 
 # --- Extract Day, Week, and Year Automatically ---
 df['date'] = df['timestamp'].dt.date
 df['week'] = df['timestamp'].dt.isocalendar().week
 df['year'] = df['timestamp'].dt.isocalendar().year  # handles year/week overlaps
+df['day_name'] = df['timestamp'].dt.strftime('%a %m/%d')  # axis labels, formatted once
 
 # --- Determine current date and rolling 7-day window ---
 current_date = dt.date.today()
@@ -46,10 +50,14 @@ colors = {
     "accent": "#F59E0B"
 }
 
+# --- Per day and person aggregates (shared by charts 1 and 3) ---
+daily_stats = df_week.groupby(['date', 'day_name', 'name'], observed=True).agg(
+    count=('name', 'size'),
+    confidence=('confidence', 'mean')
+).reset_index()
+
 # --- 1️⃣ 7 Days Visualization (Day by Day with Name Detections) ---
-daily_counts = df_week.groupby(['date', 'name']).size().reset_index(name='count')
-# Add day names for better readability
-daily_counts['day_name'] = pd.to_datetime(daily_counts['date']).dt.strftime('%a %m/%d')
+daily_counts = daily_stats[['date', 'day_name', 'name', 'count']]
 
 fig1 = px.bar(
     daily_counts,
@@ -121,9 +129,8 @@ else:
     )
 
 # --- 3️⃣ Total Detections Confidence Level (Last 7 Days Area Plot) ---
-# Calculate confidence by person and date
-confidence_by_person = df_week.groupby(['date', 'name'])['confidence'].mean().reset_index()
-confidence_by_person['day_name'] = pd.to_datetime(confidence_by_person['date']).dt.strftime('%a %m/%d')
+# Confidence by person and date
+confidence_by_person = daily_stats[['date', 'day_name', 'name', 'confidence']]
 
 fig3 = px.line(
     confidence_by_person,